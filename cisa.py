@@ -1,161 +1,218 @@
-import json
+import argparse
+import logging
 import re
-from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from html import unescape
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
 from rich.console import Console
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 
-from utils import fetch, MitreAttack, TTP_REGEX
+from utils import fetch, setup_logging, write_json, MitreAttack, TTPInfo, MAX_WORKERS, TTP_RE
 
 BASE = "https://www.cisa.gov"
 INDEX = "https://www.cisa.gov/news-events/cybersecurity-advisories?f[0]=advisory_type%3A94"
 
+HEADER_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+HEADER_SELECTOR = "h1, h2, h3, h4, h5, h6"
+# BS4's get_text skips the contents of these, since they aren't page text
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+# capture formats like 'OCT 09, 2025', 'Oct 9, 2025', 'February 01, 2024'
+_DATE_RE = re.compile(r"([A-Za-z]{3,9}\s+\d{1,2},\s+\d{4})")
+_TIME_RE = re.compile(r"<time\b[^>]*>(.*?)</time>", re.I | re.S)
+_TAG_RE = re.compile(r"<[^>]+>")
+_ADVISORY_LINK_RE = re.compile(
+    r"""<a\s[^>]*?href=["']((?:https://www\.cisa\.gov)?/news-events/cybersecurity-advisories/[^"'?#]+)["'][^>]*>(.*?)</a>""",
+    re.I | re.S,
+)
+
+# Full and abbreviated English month names, the same set strptime's %B and %b accept
+_MONTH_NAMES = ["january", "february", "march", "april", "may", "june", "july",
+                "august", "september", "october", "november", "december"]
+_MONTHS = {
+    **{name: i for i, name in enumerate(_MONTH_NAMES, 1)},
+    **{name[:3]: i for i, name in enumerate(_MONTH_NAMES, 1)},
+}
+
 console = Console()
 print = console.print
+log = logging.getLogger("scraper.cisa")
 
 
-def parse_advisory_page(html: str) -> dict:
-    soup = BeautifulSoup(html, "html.parser")
+def parse_advisory_page(tree: LexborHTMLParser) -> dict:
     title = "(no title)"
-    h1 = soup.find("h1")
-    if h1 and h1.get_text(strip=True):
-        title = h1.get_text(strip=True)
+    h1 = tree.css_first("h1")
+    if h1 and h1.text(strip=True):
+        title = h1.text(strip=True)
 
     date_text = "(no date)"
-    time_tag = soup.find("time")
-    if time_tag and time_tag.get_text(strip=True):
-        date_text = time_tag.get_text(strip=True)
+    time_tag = tree.css_first("time")
+    if time_tag and time_tag.text(strip=True):
+        date_text = time_tag.text(strip=True)
 
     return {"title": title, "date": date_text}
 
 
+def quick_parse_advisory_date(html: str) -> str:
+    # Regex-only date lookup for pages without TTPs; only the date is needed to check the
+    # cutoff, so the title isn't extracted at all
+    time_tag = _TIME_RE.search(html)
+    if time_tag:
+        text = _TAG_RE.sub("", time_tag.group(1)).strip()
+        if text:
+            return unescape(text)
+    return "(no date)"
+
+
 def parse_date(date_text: str | None) -> date | None:
     if not date_text:
         return None
-    # capture formats like 'OCT 09, 2025', 'Oct 9, 2025', 'February 01, 2024'
-    m = re.search(r"([A-Za-z]{3,9}\s+\d{1,2},\s+\d{4})", date_text)
+    m = _DATE_RE.search(date_text)
     if not m:
         return None
-    s = m.group(1)
-    for fmt in ("%b %d, %Y", "%B %d, %Y"):
-        try:
-            return datetime.strptime(s, fmt).date()
-        except ValueError:
-            continue
-    return None
+    month_text, day_text, year_text = m.group(1).split()
+    month = _MONTHS.get(month_text.lower())
+    if month is None:
+        return None
+    try:
+        return date(int(year_text), month, int(day_text.rstrip(",")))
+    except ValueError:
+        return None
 
 
 def contains_ttps(text: str) -> bool:
-    return bool(re.search(r"\b(T\d{4}(?:\.\d{1,3})?)\b", text))
+    return bool(TTP_RE.search(text))
 
 
-def extract_advisory_fields(html: str, mitre_attack: MitreAttack) -> dict:
-    soup = BeautifulSoup(html, "html.parser")
-    
-    def get_matching_keywords(soup: BeautifulSoup, keywords: list[str]) -> str:
-        for hdr in soup.find_all(re.compile(r"^h[1-6]$")):
-            txt = hdr.get_text(strip=True).lower()
+def node_text(node: LexborNode) -> str:
+    # Same result as BS4's get_text(separator=" ", strip=True). selectolax's
+    # text(separator=" ", strip=True) also joins whitespace-only text nodes, which leaves
+    # doubled and trailing spaces wherever the markup has newlines between tags
+    parts: list[str] = []
+    for n in node.traverse(include_text=True):
+        if n.tag != "-text" or n.parent is None or n.parent.tag in NON_TEXT_TAGS:
+            continue
+        t = n.text_content.strip()
+        if t:
+            parts.append(t)
+    return " ".join(parts)
+
+
+def extract_sections(tree: LexborHTMLParser) -> dict[str, str]:
+    # Split the page into sections keyed by lowercased header text in a single
+    # document-order pass. A section runs until the next same-or-higher-level header
+    # and collects the text of lower-level headers and paragraph-like content
+    # (p, ul, ol, div) inside it. If two headers share the same text, the first wins.
+    if tree.root is None:
+        return {}
+
+    header_level: dict[int, int] = {}
+    first_header_below: dict[int, int] = {}
+    for hdr in tree.css(HEADER_SELECTOR):
+        level = int(hdr.tag[1])
+        for node in hdr.traverse():
+            header_level.setdefault(node.mem_id, level)
+        anc = hdr.parent
+        while anc is not None:
+            first_header_below.setdefault(anc.mem_id, level)
+            anc = anc.parent
+
+    sections: dict[str, list[str]] = {}
+    open_sections: list[tuple[int, list[str]]] = []
+
+    for elem in tree.root.traverse():
+        name = elem.tag
+        if name in HEADER_TAGS:
+            level = int(name[1])
+            # A same-or-higher-level header closes every section at its level or below
+            while open_sections and open_sections[-1][0] >= level:
+                open_sections.pop()
+            t = node_text(elem)
+            if t:
+                for _, parts in open_sections:
+                    parts.append(t)
+            key = elem.text(strip=True).lower()
+            section: list[str] = []
+            if key not in sections:
+                sections[key] = section
+            open_sections.append((level, section))
+            continue
+
+        # Content inside a header was already captured with the header text
+        if elem.mem_id in header_level or name not in ("p", "ul", "ol", "div"):
+            continue
+
+        # A container holding a header ends the sections that header would close; its
+        # aggregated text is skipped since the header and its content are handled when
+        # they are reached
+        desc_level = first_header_below.get(elem.mem_id)
+        if desc_level is not None:
+            while open_sections and open_sections[-1][0] >= desc_level:
+                open_sections.pop()
+            continue
+
+        t = node_text(elem)
+        if t:
+            for _, parts in open_sections:
+                parts.append(t)
+
+    return {key: "\n\n".join(parts).strip() for key, parts in sections.items()}
+
+
+def extract_advisory_fields(tree: LexborHTMLParser, mitre_attack: MitreAttack) -> dict:
+
+    def get_matching_keywords(sections: dict[str, str], keywords: list[str]) -> str:
+        for txt, content in sections.items():
             if any(k in txt for k in keywords):
-                parts: list[str] = []
-                hdr_level = int(hdr.name[1])
-
-                # Walk document-order from the header forward. For each element we check
-                # whether that element or any of its ancestor tags is a header. If we
-                # encounter any header (other than the originating header) whose level
-                # is <= hdr_level, we stop collecting. Lower-level headers (level >
-                # hdr_level) are included when encountered.
-                for elem in hdr.next_elements:
-                    # Only consider Tag elements
-                    name = getattr(elem, "name", None)
-                    if not name:
-                        continue
-
-                    # If this element is a header itself, or has a header ancestor, find it
-                    header_anc = None
-                    if re.match(r"^h[1-6]$", name, flags=re.I):
-                        header_anc = elem
-                    else:
-                        header_anc = elem.find_parent(re.compile(r"^h[1-6]$"))
-
-                    # If we found a header ancestor that's not the original header,
-                    # decide whether to stop or include the header text.
-                    if header_anc and header_anc is not hdr:
-                        anc_level = int(getattr(header_anc, "name")[1])
-                        if anc_level <= hdr_level:
-                            # Reached same-or-higher-level header anywhere in subtree -> stop
-                            break
-                        # Lower-level header: include its text when we encounter the header tag
-                        if elem is header_anc:
-                            t = header_anc.get_text(separator=" ", strip=True)
-                            if t:
-                                parts.append(t)
-                        # continue scanning after handling header tag
-                        continue
-
-                    # Collect paragraph-like content (p, ul, ol, div)
-                    if name in ("p", "ul", "ol", "div"):
-                        # If this element contains a header descendant, handle specially:
-                        # - if it contains a same-or-higher-level header, stop (we've reached
-                        #   the next section)
-                        # - if it contains only lower-level headers, skip appending the
-                        #   container's aggregated text (the lower-level headers will be
-                        #   handled when encountered as elements)
-                        hdr_desc = None
-                        if hasattr(elem, "find"):
-                            hdr_desc = getattr(elem, "find")(re.compile(r"^h[1-6]$"))
-                        if hdr_desc:
-                            desc_level = int(getattr(hdr_desc, "name")[1])
-                            if desc_level <= hdr_level:
-                                break
-                            # lower-level header descendant: don't append container text
-                            # (we'll handle the header element itself when we reach it)
-                            continue
-
-                        t = elem.get_text(separator=" ", strip=True)
-                        if t:
-                            parts.append(t)
-                            
-                if len(parts) == 0:
-                    print(f"    :warning: Unable to capture content in section matching {keywords}", style="yellow")
-                return "\n\n".join(parts).strip()
+                if len(content) == 0:
+                    log.warning("    :warning: Unable to capture content in section matching %s", keywords)
+                return content
             
-        print(f"    :warning: Cannot find header matching {keywords}", style="yellow")
+        log.warning("    :warning: Cannot find header matching %s", keywords)
         return ""
 
-    def get_summary(soup: BeautifulSoup) -> str:
-        return get_matching_keywords(soup, ["executive summary", "introduction", "summary", "overview"])
-
-    def get_ttps(soup: BeautifulSoup, mitre_attack: MitreAttack) -> list[dict]:
-        ttps: list[dict] = []
-        text_blob = soup.get_text(separator=" ", strip=True)
-        for m in re.finditer(TTP_REGEX, text_blob):
+    def get_summary(sections: dict[str, str]) -> str:
+        return get_matching_keywords(sections, ["executive summary", "introduction", "summary", "overview"])
+
+    def get_ttps(tree: LexborHTMLParser, mitre_attack: MitreAttack) -> list[TTPInfo]:
+        # Match against the page text, not the raw HTML, so IDs that only appear in markup
+        # (the parent technique in a sub-technique's attack.mitre.org href, scripts,
+        # attributes) aren't picked up
+        seen: set[str] = set()
+        tids: list[str] = []
+        text = node_text(tree.root) if tree.root is not None else ""
+        for m in TTP_RE.finditer(text):
             tid = m.group(1)
-            if not any(t.get("id") == tid for t in ttps):
-                ttps.append(mitre_attack.get_mitre_info(tid))
-        return ttps
+            if tid in seen:
+                continue
+            seen.add(tid)
+            tids.append(tid)
 
-    def get_mitigations(soup: BeautifulSoup) -> str:
-        return get_matching_keywords(soup, ["mitigation"])
+        return mitre_attack.get_many(tids)
 
+    def get_mitigations(sections: dict[str, str]) -> str:
+        return get_matching_keywords(sections, ["mitigation"])
 
-    summary = get_summary(soup)
-    mitigations = get_mitigations(soup)
-    ttps = get_ttps(soup, mitre_attack)
+
+    sections = extract_sections(tree)
+    summary = get_summary(sections)
+    mitigations = get_mitigations(sections)
+    ttps = get_ttps(tree, mitre_attack)
 
     return {"title": "(no title)", "source": "cisa", "url": "(no url)", "date": "(no date)", "summary": summary, "mitigations": mitigations, "ttps": ttps}
 
 
 def get_index_items(url: str):
     html = fetch(url)
-    soup = BeautifulSoup(html, "html.parser")
-    # common listing anchors live under h3 or h2 tags on this page
-    for a in soup.select("h3 a, h2 a, .views-row a, article a"):
-        href = a.get("href")
-        title = a.get_text(strip=True)
-        if not href or not title:
+    # Advisory teasers link to /news-events/cybersecurity-advisories/<id>; a regex over
+    # the raw listing finds them without building a parse tree for every index page
+    for m in _ADVISORY_LINK_RE.finditer(html):
+        href, title = m.group(1), _TAG_RE.sub("", m.group(2)).strip()
+        if not title:
             continue
-        yield urljoin(BASE, str(href))
+        yield urljoin(BASE, href)
 
 
 
@@ -170,49 +227,68 @@ def scrape(max_pages = 17, cutoff = date(2017, 1, 1)) -> tuple[list[dict], int]:
     
     for p in range(0, max_pages):
         page_url = f"{INDEX}&page={p}"
-        print(f":file_folder: Scanning index page {p}/{max_pages-1} -> {page_url}", style="bright_black")
-        for item_url in get_index_items(page_url):
-            try:
-                html = fetch(item_url)
-            except Exception as e:
-                print(f":x: Failed to fetch {item_url}: {e}", style="bright_black")
-                continue
-
-            parsed = parse_advisory_page(html)
-            d = parse_date(parsed["date"])
-            if d is None:
-                print(f":warning: No date found: {item_url}", style="yellow")
-                continue
-            if d < cutoff:
-                print(f":date: Reached date cutoff of {cutoff.isoformat()}, quitting", style="bright_black")
-                return matches, total_ttps
-
-            if contains_ttps(html):
-                print(f"  :mag: Found page with TTPs -> {item_url}", style="bright_black")
-                key = f"{parsed["title"]}||{d.isoformat()}"
-                if key in seen_keys:
-                    print(f"    :warning: Skipping duplicate advisory {parsed["title"]} ({d.isoformat()})", style="yellow")
+        log.debug(":file_folder: Scanning index page %d/%d -> %s", p, max_pages - 1, page_url)
+        item_urls = list(get_index_items(page_url))
+
+        # Download every advisory on the page concurrently, then process them in index order
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            futures = [ex.submit(fetch, item_url) for item_url in item_urls]
+            for item_url, future in zip(item_urls, futures):
+                try:
+                    html = future.result()
+                except Exception as e:
+                    log.error(":x: Failed to fetch %s: %s", item_url, e)
+                    continue
+
+                # Only pages with TTPs need a full parse, and that one tree is shared by
+                # parse_advisory_page and extract_advisory_fields
+                has_ttps = contains_ttps(html)
+                if has_ttps:
+                    tree = LexborHTMLParser(html)
+                    parsed = parse_advisory_page(tree)
+                    date_text = parsed["date"]
                 else:
-                    fields = extract_advisory_fields(html, mitre_attack)
-                    fields["title"] = parsed["title"]
-                    fields["date"] = d.isoformat()
-                    fields["url"] = item_url
-                    seen_keys.add(key)
-                    matches.append(fields)
-
-                    num_ttps = len(fields["ttps"])
-                    print(f"    :pick: Extracted {num_ttps} TTPs", style="bright_black")
-                    total_ttps += num_ttps
-            else:
-                print(f"  :heavy_minus_sign: No TTPs found        -> {item_url}", style="bright_black")
+                    date_text = quick_parse_advisory_date(html)
+
+                d = parse_date(date_text)
+                if d is None:
+                    log.warning(":warning: No date found: %s", item_url)
+                    continue
+                if d < cutoff:
+                    log.info(":date: Reached date cutoff of %s, quitting", cutoff.isoformat())
+                    ex.shutdown(cancel_futures=True)
+                    return matches, total_ttps
+
+                if has_ttps:
+                    log.debug("  :mag: Found page with TTPs -> %s", item_url)
+                    key = f"{parsed["title"]}||{d.isoformat()}"
+                    if key in seen_keys:
+                        log.warning("    :warning: Skipping duplicate advisory %s (%s)", parsed["title"], d.isoformat())
+                    else:
+                        fields = extract_advisory_fields(tree, mitre_attack)
+                        fields["title"] = parsed["title"]
+                        fields["date"] = d.isoformat()
+                        fields["url"] = item_url
+                        seen_keys.add(key)
+                        matches.append(fields)
+
+                        num_ttps = len(fields["ttps"])
+                        log.debug("    :pick: Extracted %d TTPs", num_ttps)
+                        total_ttps += num_ttps
+                else:
+                    log.debug("  :heavy_minus_sign: No TTPs found        -> %s", item_url)
 
     return matches, total_ttps
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Scrape TTPs from CISA cybersecurity advisories")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress for every index page and advisory")
+    args = parser.parse_args()
+    setup_logging(args.verbose)
+
     matches, total_ttps = scrape()
     output_file = "cisa-out.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(matches, f, indent=2)
+    write_json(output_file, matches)
     print(f"Wrote {len(matches)} matching advisories to {output_file} with {total_ttps} total TTPs")
 
 
@@ -1,34 +1,54 @@
+import argparse
 import json
+import logging
+import os
 import re
 
 from pathlib import Path
 from typing import Any, Iterator
 from rich.console import Console
 
-from utils import MitreAttack, TTP_REGEX
+from utils import parse_json, setup_logging, write_json, MitreAttack, TTPInfo, TTP_RE
 
 BASE_URL = "https://raw.githubusercontent.com/Cisco-Talos/IOCs/refs/heads/main"
 TALOS_BLOG_REGEX = r"""(?:https?://)?blog\.talosintelligence\.com(?:/[^\s'"\)\]\}>,.;:]*)?"""
 
 console = Console()
 print = console.print
+log = logging.getLogger("scraper.talos")
+
+def walk_json_files(root: str) -> Iterator[str]:
+    # Iterative os.scandir walk; DirEntry caches the type info, so each entry is
+    # stat'ed at most once and no Path objects are built along the way
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".json") and entry.is_file():
+                    yield entry.path
+
+def load_talos_ioc_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        return parse_json(f.read())
 
 def yield_talos_ioc_jsons(talos_root: Path) -> Iterator[tuple[str, Any]]:
     root = Path(talos_root).resolve()
     if not root.exists() or not root.is_dir():
         return
 
-    # Deterministic ordering makes results predictable in tests and CLIs
-    for path in sorted(root.rglob("*.json")):
-        if not path.is_file():  # defensive, though rglob("*.json") should already be files
-            continue
+    # Deterministic ordering makes results predictable in tests and CLIs. Sort by path
+    # components so the order matches sorting Path objects.
+    paths = sorted(walk_json_files(str(root)), key=lambda p: p.split(os.sep))
 
-        rel = path.relative_to(root).as_posix()
+    # Parsed in-process: with orjson, unpickling a worker's result costs about as much as
+    # parsing the file, so a process pool only adds startup and IPC on top
+    for path in paths:
+        rel = Path(path).relative_to(root).as_posix()
         url = f"{BASE_URL}/{rel}"
-        text = path.read_text(encoding="utf-8")
-        obj = json.loads(text)
 
-        yield url, obj
+        yield url, load_talos_ioc_json(path)
 
 class TalosReport:
     def __init__(self, url: str, contents: Any, mitre_attack: MitreAttack):
@@ -36,17 +56,6 @@ class TalosReport:
         self.contents = contents
         self.mitre_attack = mitre_attack
 
-    def get_nested(self, dictn, keys: list[str], default=None):
-        d = dictn
-        for key in keys:
-            if key == "[0]" and len(d) > 0:
-                d = d[0]
-            elif isinstance(d, dict) and key in d:
-                d = d[key]
-            else:
-                return default
-        return d
-    
     def add_https_to_url(self, url: str) -> str:
         if not url.startswith("https://"):
             return f"https://{url}"
@@ -56,36 +65,27 @@ class TalosReport:
         # Has the format { "type": "bundle", ... }
         objects = self.contents.get("objects")
         if objects is not None:
-            for obj in objects:
-                if obj.get("type") == "report":
-                    return obj.get("name")
+            report = next((obj for obj in objects if obj.get("type") == "report"), None)
+            if report is not None:
+                return report.get("name")
 
         # Has the format { "id": ... }
-        title = self.get_nested(self.contents, [
-            "related_packages",
-            "related_packages",
-            "[0]",
-            "package",
-            "incidents",
-            "[0]",
-            "title",
-        ])
-
-        if title is not None:
-            return title
+        try:
+            title = self.contents["related_packages"]["related_packages"][0]["package"]["incidents"][0]["title"]
+            if title is not None:
+                return title
+        except (KeyError, IndexError, TypeError):
+            pass
         
         # Has the format { "response": ... } (reddriver.json)
-        title = self.get_nested(self.contents, [
-            "response",
-            "[0]",
-            "Event",
-            "info",
-        ])
-
-        if title is not None:
-            return title
+        try:
+            title = self.contents["response"][0]["Event"]["info"]
+            if title is not None:
+                return title
+        except (KeyError, IndexError, TypeError):
+            pass
         
-        print(f"    :warning: No title found", style="red")
+        log.warning("    :warning: No title found")
         return ""
     
     def find_url(self) -> str:
@@ -94,19 +94,19 @@ class TalosReport:
         if len(matches) == 1:
             return self.add_https_to_url(matches[0])
         if len(matches) > 1:
-            print(f"    :warning: More than one URL found, only capturing the first", style="yellow")
+            log.warning("    :warning: More than one URL found, only capturing the first")
             return self.add_https_to_url(matches[0])
                     
-        print(f"    :warning: No URL found", style="yellow")
+        log.warning("    :warning: No URL found")
         return ""
 
     def find_date(self) -> str:
         # Has the format { "type": "bundle", ... }
         objects = self.contents.get("objects")
         if objects is not None:
-            for obj in objects:
-                if obj.get("type") == "identity":
-                    return obj.get("created")
+            identity = next((obj for obj in objects if obj.get("type") == "identity"), None)
+            if identity is not None:
+                return identity.get("created")
                 
         # Has the format { "id": ... }
         timestamp = self.contents.get("timestamp")
@@ -114,20 +114,18 @@ class TalosReport:
             return timestamp
         
         # Has the format { "response": ... } (reddriver.json)   
-        timestamp = self.get_nested(self.contents, [
-            "response",
-            "[0]",
-            "Event",
-            "date",
-        ])
-        if timestamp is not None:
-            return timestamp
+        try:
+            timestamp = self.contents["response"][0]["Event"]["date"]
+            if timestamp is not None:
+                return timestamp
+        except (KeyError, IndexError, TypeError):
+            pass
                 
-        print(f"    :warning: No date found", style="red")
+        log.warning("    :warning: No date found")
         return ""
     
-    def find_ttps(self) -> list[dict[str, Any]]:
-        ttps = []
+    def find_ttps(self) -> list[TTPInfo]:
+        found: list[str] = []
         
         # Has the format { "type": "bundle", ... }
         objects = self.contents.get("objects")
@@ -137,85 +135,76 @@ class TalosReport:
                     ttp_text = obj.get("name")
                     if ttp_text is None:
                         continue
-                    tids = re.findall(TTP_REGEX, ttp_text)
+                    tids = TTP_RE.findall(ttp_text)
                     if len(tids) == 0:
                         continue
-                    tid = tids[0]
-                    ttps.append(self.mitre_attack.get_mitre_info(tid))
+                    found.append(tids[0])
 
-        if len(ttps) > 0:
-            return ttps
+        if len(found) > 0:
+            return self.mitre_attack.get_many(found)
         
         # Has the format { "id": ... }
-        ttp_objects = self.get_nested(self.contents, [
-            "related_packages",
-            "related_packages",
-            "[0]",
-            "package",
-            "ttps",
-            "ttps",
-        ])
+        try:
+            ttp_objects = self.contents["related_packages"]["related_packages"][0]["package"]["ttps"]["ttps"]
+        except (KeyError, IndexError, TypeError):
+            ttp_objects = None
         if ttp_objects is not None:
             for obj in ttp_objects:
-                ttp_text = self.get_nested(obj, [
-                    "behavior",
-                    "attack_patterns",
-                    "[0]",
-                    "title"
-                ])
+                try:
+                    ttp_text = obj["behavior"]["attack_patterns"][0]["title"]
+                except (KeyError, IndexError, TypeError):
+                    continue
                 if ttp_text is None:
                     continue
-                tids = re.findall(TTP_REGEX, ttp_text)
+                tids = TTP_RE.findall(ttp_text)
                 if len(tids) == 0:
                     continue
-                tid = tids[0]
-                ttps.append(self.mitre_attack.get_mitre_info(tid))
+                found.append(tids[0])
         
-        if len(ttps) > 0:
-            return ttps
+        if len(found) > 0:
+            return self.mitre_attack.get_many(found)
 
         # Has the format { "response": ... } (reddriver.json)   
-        ttp_objects = self.get_nested(self.contents, [
-            "response",
-            "[0]",
-            "Event",
-            "Galaxy",
-            "[0]",
-            "GalaxyCluster",
-        ])
+        try:
+            ttp_objects = self.contents["response"][0]["Event"]["Galaxy"][0]["GalaxyCluster"]
+        except (KeyError, IndexError, TypeError):
+            ttp_objects = None
         if ttp_objects is not None:
             for obj in ttp_objects:
                 ttp_text = obj.get("value")
                 if ttp_text is None:
                     continue
-                tids = re.findall(TTP_REGEX, ttp_text)
+                tids = TTP_RE.findall(ttp_text)
                 if len(tids) == 0:
                     continue
-                tid = tids[0]
-                ttps.append(self.mitre_attack.get_mitre_info(tid))
+                found.append(tids[0])
 
-        if len(ttps) > 0:
-            return ttps
+        if len(found) > 0:
+            return self.mitre_attack.get_many(found)
         
         # Last resort: regex search the entire text for TTPs
         text = json.dumps(self.contents)
-        for tid in re.findall(TTP_REGEX, text):
-            ttps.append(self.mitre_attack.get_mitre_info(tid))
-        if len(ttps) > 0:
-            return ttps
+        found = TTP_RE.findall(text)
+        if len(found) > 0:
+            return self.mitre_attack.get_many(found)
         
-        print(f"    :warning: No TTPs found", style="yellow")
+        log.warning("    :warning: No TTPs found")
         return []
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract TTPs from Cisco Talos IOC files")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every IOC file as it is analyzed")
+    args = parser.parse_args()
+    setup_logging(args.verbose)
+
     root = Path(__file__).parent / "talos-iocs"
     total_ttps = 0
     mitre_attack = MitreAttack()
     reports: list[dict] = []
 
     for url, contents in yield_talos_ioc_jsons(root):
-        print(f":mag: Analyzing {url}", style="bright_black")
+        log.debug(":mag: Analyzing %s", url)
         talos_report = TalosReport(url, contents, mitre_attack)
         ttps = talos_report.find_ttps()
         reports.append({
@@ -230,8 +219,7 @@ def main():
         total_ttps += len(ttps)
 
     output_file = "talos-out.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(reports, f, indent=2)
+    write_json(output_file, reports)
 
     print(f"Wrote {len(reports)} matching reports to {output_file} with {total_ttps} total TTPs")
 
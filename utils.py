@@ -1,76 +1,366 @@
+import dataclasses
+import functools
+import hashlib
+import httpx
 import json
+import logging
+import os
+import pickle
 import re
-import requests
+import threading
+import time
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from mitreattack.stix20 import MitreAttackData
+from pathlib import Path
 from rich.console import Console
-from stix2 import MemoryStore
-from typing import Any
+from rich.logging import RichHandler
+from stix2 import MemoryStore, __version__ as STIX2_VERSION
+from typing import Any, Iterable
 from urllib.parse import urljoin
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 console = Console()
 print = console.print
+# Per-TTP warnings go through logging; rich printing is kept for the startup messages
+log = logging.getLogger("scraper.utils")
 
 MITRE_ENTERPRISE_ATTACK = "https://raw.githubusercontent.com/mitre/cti/master/enterprise-attack/enterprise-attack.json"
 MITRE_MOBILE_ATTACK = "https://raw.githubusercontent.com/mitre/cti/master/mobile-attack/mobile-attack.json"
 MITRE_ICS_ATTACK = "https://raw.githubusercontent.com/mitre/cti/master/ics-attack/ics-attack.json"
 
+MITRE_BUNDLES = {
+    "Enterprise": MITRE_ENTERPRISE_ATTACK,
+    "Mobile": MITRE_MOBILE_ATTACK,
+    "ICS": MITRE_ICS_ATTACK,
+}
+
+CACHE_DIR = Path.home() / ".cache" / "cisa-ttp-scraper"
+MITRE_NAME_CACHE = CACHE_DIR / "mitre-names.json"
+MITRE_STORE_CACHE = CACHE_DIR / "mitre-store.pkl"
+MITRE_STORE_MANIFEST = CACHE_DIR / "mitre-store.json"
+HTTP_CACHE_DIR = CACHE_DIR / "http"
+
+MAX_WORKERS = 16
+
 TTP_REGEX = r"\b(T\d{4}(?:\.\d{1,3})?)\b"
+TTP_RE = re.compile(TTP_REGEX)
+
+_META_URL_RE = re.compile(r"url=(.+)$", re.I)
+_COLON_RE = re.compile(r":(?!:)")
+_REFRESH_RE = re.compile(r"^refresh$", re.I)
+
+# scrape_mitre_name only reads the title and a possible meta-refresh, so skip building
+# the rest of the technique page
+_MITRE_PAGE_STRAINER = SoupStrainer(["h1", "meta"])
+
+# One HTTP/2 client for every request. attack.mitre.org and raw.githubusercontent.com
+# multiplex concurrent fetches over a single TLS connection each; hosts without h2
+# (cisa.gov) fall back to pooled HTTP/1.1 keep-alive connections
+_CLIENT = httpx.Client(
+    headers={
+        "User-Agent": "cisa-ttp-scraper/0.1.0 (+https://github.com/TenType/cisa-ttp-scraper)",
+        # Most fetches are HTML pages; the STIX bundle requests override this
+        "Accept": "text/html,application/xhtml+xml,*/*;q=0.8",
+        # brotli/gzip responses are decoded transparently by httpx (br needs the brotli package)
+        "Accept-Encoding": "br, gzip, deflate",
+    },
+    follow_redirects=True,
+    timeout=30,
+    # The transport's retries only cover failed connects; _request retries bad statuses
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    ),
+)
+
+_STIX_HEADERS = {"Accept": "application/json, text/html;q=0.5"}
+
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_RETRY_TOTAL = 3
+_RETRY_BACKOFF = 0.5
+_STREAM_CHUNK = 64 * 1024
+
+def _request(method: str, url: str, stream: bool = False, **kwargs: Any) -> httpx.Response:
+    # Retry throttled and 5xx responses with exponential backoff, handing back the last
+    # response once the retries run out
+    for attempt in range(_RETRY_TOTAL):
+        resp = _CLIENT.send(_CLIENT.build_request(method, url, **kwargs), stream=stream)
+        if resp.status_code not in _RETRY_STATUSES:
+            return resp
+        resp.close()
+        time.sleep(_RETRY_BACKOFF * 2 ** attempt)
+    return _CLIENT.send(_CLIENT.build_request(method, url, **kwargs), stream=stream)
+
+def cached_get(url: str, timeout: int = 30, headers: dict[str, str] | None = None) -> tuple[bytes, str | None]:
+    # Keep a copy of every response that carries an ETag or Last-Modified header in
+    # HTTP_CACHE_DIR and revalidate it with a conditional GET, so unchanged pages and
+    # bundles come back as a cheap 304 instead of a full download
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    body_path = HTTP_CACHE_DIR / key
+    meta_path = HTTP_CACHE_DIR / f"{key}.json"
+
+    cached: dict[str, Any] = {}
+    request_headers = dict(headers or {})
+    if body_path.exists() and meta_path.exists():
+        cached = json.loads(meta_path.read_text(encoding="utf-8"))
+        if cached.get("etag"):
+            request_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            request_headers["If-Modified-Since"] = cached["last_modified"]
+
+    resp = _request("GET", url, stream=True, headers=request_headers, timeout=timeout)
+    log.debug("%s %s (%s)", resp.status_code, url, resp.headers.get("Content-Encoding", "identity"))
+    try:
+        if resp.status_code == 304:
+            return body_path.read_bytes(), cached.get("encoding")
+        resp.raise_for_status()
+
+        # The charset from Content-Type, or utf-8 (the same fallback resp.text uses)
+        encoding = resp.encoding
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return resp.read(), encoding
+
+        HTTP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write through temporary files so concurrent fetches never see a partial entry.
+        # The body is streamed straight to disk and read back in one allocation, so a
+        # multi-megabyte bundle is never held as downloaded chunks plus their joined copy
+        tmp_body = body_path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        with tmp_body.open("wb") as f:
+            for chunk in resp.iter_bytes(_STREAM_CHUNK):
+                f.write(chunk)
+    finally:
+        resp.close()
+    content = tmp_body.read_bytes()
+    os.replace(tmp_body, body_path)
+    tmp_meta = meta_path.with_name(f"{key}.json.{threading.get_ident()}.tmp")
+    tmp_meta.write_text(json.dumps({
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "encoding": encoding,
+    }), encoding="utf-8")
+    os.replace(tmp_meta, meta_path)
+    return content, encoding
 
 def fetch(url: str, timeout: int = 30) -> str:
-    resp = requests.get(url, timeout=timeout)
-    resp.raise_for_status()
-    return resp.text
+    content, encoding = cached_get(url, timeout)
+    try:
+        return str(content, encoding or "utf-8", errors="replace")
+    except LookupError:
+        return str(content, errors="replace")
+
+def fetch_bytes(url: str, timeout: int = 30, headers: dict[str, str] | None = None) -> bytes:
+    content, _ = cached_get(url, timeout, headers)
+    return content
+
+def fetch_etag(url: str, timeout: int = 30, headers: dict[str, str] | None = None) -> str | None:
+    try:
+        resp = _request("HEAD", url, headers=headers, timeout=timeout)
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return resp.headers.get("ETag")
+
+def parse_json(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def setup_logging(verbose: bool = False) -> None:
+    # Per-advisory progress is logged at DEBUG, so quiet runs skip rendering it entirely
+    logger = logging.getLogger("scraper")
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.addHandler(RichHandler(console=console, markup=True, show_time=False, show_level=False, show_path=False))
+    logger.propagate = False
+
+def write_json(path: str, obj: Any) -> None:
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        return
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, default=dataclasses.asdict)
+
+# Slotted instead of a dict per lookup; orjson (and write_json's json fallback via
+# dataclasses.asdict) still serializes it as {"name", "id", "tactics"}
+@dataclasses.dataclass(frozen=True, slots=True)
+class TTPInfo:
+    name: str
+    id: str
+    tactics: tuple[str, ...]
 
 class MitreAttack:
     def __init__(self):
         self.data = self.prepare_mitre_attack_data()
+        self.techniques = self.index_techniques()
+        self.name_cache = self.load_name_cache()
+        self.name_cache_lock = threading.Lock()
+        self.name_cache_dirty = False
+        self.resolved_misses: set[str] = set()
+
+        # Memoize per instance rather than with a class-level decorator, so the caches
+        # (and the STIX data they reference through self) are freed with the instance
+        self._resolve_ttp = functools.lru_cache(maxsize=8192)(self._resolve_ttp)
+        self.scrape_mitre_name = functools.lru_cache(maxsize=None)(self.scrape_mitre_name)
 
     def prepare_mitre_attack_data(self) -> MitreAttackData:
         print(":books: Preparing MITRE ATT&CK data files", style="bright_black")
-        mem_store = MemoryStore()
 
-        print("  :inbox_tray: Loading Enterprise", style="bright_black")
-        enterprise_json = json.loads(fetch(MITRE_ENTERPRISE_ATTACK))
-        mem_store.add(enterprise_json)
+        # A pickled store from a previous run is only reused while all three bundles
+        # still carry the ETags it was built from, and stix2 is the version that pickled it
+        with ThreadPoolExecutor(max_workers=len(MITRE_BUNDLES)) as ex:
+            etags = list(ex.map(functools.partial(fetch_etag, headers=_STIX_HEADERS), MITRE_BUNDLES.values()))
+        manifest = {**dict(zip(MITRE_BUNDLES.values(), etags)), "stix2": STIX2_VERSION} if all(etags) else None
 
-        print("  :inbox_tray: Loading Mobile", style="bright_black")
-        mobile_json = json.loads(fetch(MITRE_MOBILE_ATTACK))
-        mem_store.add(mobile_json)
-
-        print("  :inbox_tray: Loading ICS", style="bright_black")
-        ics_json = json.loads(fetch(MITRE_ICS_ATTACK))
-        mem_store.add(ics_json)
+        mem_store = self.load_store_cache(manifest)
+        if mem_store is None:
+            mem_store = self.download_mitre_store()
+            self.save_store_cache(manifest, mem_store)
 
         return MitreAttackData(src=mem_store)
 
-    def get_mitre_info(self, tid: str) -> dict[str, Any]:
+    def download_mitre_store(self) -> MemoryStore:
+        # The three bundles are independent multi-megabyte downloads, so fetch them together
+        # and parse each one as soon as it arrives while the others are still downloading
+        print("  :globe_with_meridians: Downloading Enterprise, Mobile and ICS", style="bright_black")
+        objects: dict[str, list] = {}
+        with ThreadPoolExecutor(max_workers=len(MITRE_BUNDLES)) as ex:
+            futures = {ex.submit(fetch_bytes, url, headers=_STIX_HEADERS): domain for domain, url in MITRE_BUNDLES.items()}
+            for future in as_completed(futures):
+                domain = futures[future]
+                print(f"  :inbox_tray: Loading {domain}", style="bright_black")
+                objects[domain] = parse_json(future.result()).get("objects", [])
+
+        # Build the store from one combined object list instead of adding each bundle
+        print("  :card_index_dividers: Indexing STIX objects", style="bright_black")
+        return MemoryStore(stix_data=[obj for domain in MITRE_BUNDLES for obj in objects[domain]])
+
+    def load_store_cache(self, manifest: dict[str, str] | None) -> MemoryStore | None:
+        if manifest is None:
+            return None
+        try:
+            if json.loads(MITRE_STORE_MANIFEST.read_text(encoding="utf-8")) != manifest:
+                return None
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            with open(MITRE_STORE_CACHE, "rb") as f:
+                mem_store = pickle.load(f)
+        except Exception:
+            # The pickle is only a cache: a missing, truncated or otherwise unloadable file
+            # (e.g. written against other library versions) just means rebuilding the store
+            return None
+
+        print("  :floppy_disk: Loading cached STIX store", style="bright_black")
+        return mem_store
+
+    def save_store_cache(self, manifest: dict[str, str] | None, mem_store: MemoryStore) -> None:
+        if manifest is None:
+            return
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Per-process temporary names, since cisa.py and talos.py may save at the same time
+        tmp_path = MITRE_STORE_CACHE.with_name(f"{MITRE_STORE_CACHE.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(mem_store, f, protocol=5)
+        os.replace(tmp_path, MITRE_STORE_CACHE)
+        tmp_path = MITRE_STORE_MANIFEST.with_name(f"{MITRE_STORE_MANIFEST.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp_path, MITRE_STORE_MANIFEST)
+
+    def index_techniques(self) -> dict[str, tuple[str, tuple[str, ...]]]:
+        # One pass over every technique up front turns lookups into dict hits instead of
+        # a STIX store query per TID
+        techniques: dict[str, tuple[str, tuple[str, ...]]] = {}
+        for technique in self.data.get_techniques(include_subtechniques=True):
+            refs = technique.get("external_references") or []
+            if not refs or "external_id" not in refs[0]:
+                continue
+            tactics = tuple(p.phase_name for p in technique.get("kill_chain_phases", []))
+            techniques.setdefault(refs[0].external_id, (technique.name, tactics))
+        return techniques
+
+    def load_name_cache(self) -> dict[str, str]:
+        # Names scraped from attack.mitre.org on previous runs, keyed by TID
+        try:
+            return json.loads(MITRE_NAME_CACHE.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_name_cache(self) -> None:
+        # Called once per batch of lookups. cisa.py and talos.py share the file, so write
+        # through a temporary file rather than truncating it under a concurrent reader
+        with self.name_cache_lock:
+            if not self.name_cache_dirty:
+                return
+            MITRE_NAME_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            tmp = MITRE_NAME_CACHE.with_name(f"{MITRE_NAME_CACHE.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self.name_cache, indent=2), encoding="utf-8")
+            os.replace(tmp, MITRE_NAME_CACHE)
+            self.name_cache_dirty = False
+
+    def get_mitre_info(self, tid: str) -> TTPInfo:
+        name, tactics = self._resolve_ttp(tid)
+        return TTPInfo(name, tid, tactics)
+
+    def get_many(self, tids: Iterable[str]) -> list[TTPInfo]:
+        # Indexed techniques resolve instantly and misses from earlier batches are memoized,
+        # so only misses never seen before (which may need scraping attack.mitre.org) go to
+        # a thread pool to warm the caches; the results are then read back in order
+        tids = list(tids)
+        misses = [tid for tid in dict.fromkeys(tids) if tid not in self.techniques and tid not in self.resolved_misses]
+        if misses:
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(misses))) as ex:
+                list(ex.map(self._resolve_ttp, misses))
+            self.resolved_misses.update(misses)
+            self.save_name_cache()
+        return [self.get_mitre_info(tid) for tid in tids]
+
+    # Cached entries are shared between callers, so keep them immutable
+    def _resolve_ttp(self, tid: str) -> tuple[str, tuple[str, ...]]:
+        info = self.techniques.get(tid)
+        if info is not None:
+            return info
+
         technique = self.data.get_object_by_attack_id(tid, "attack-pattern")
         if technique:
-            tactics = [t.phase_name for t in technique.kill_chain_phases] # type: ignore
-            return {"name": technique.name, "id": tid, "tactics": tactics}
+            tactics = tuple(t.phase_name for t in technique.kill_chain_phases) # type: ignore
+            return technique.name, tactics
 
         name = self.scrape_mitre_name(tid)
         if name:
-            print(f"    :warning: Deprecated TTP, no tactics found: {tid}", style="yellow")
-            return {"name": name, "id": tid, "tactics": []}
+            log.warning("    :warning: Deprecated TTP, no tactics found: %s", tid)
+            return name, ()
         
-        print(f"    :warning: No info found for TTP: {tid}", style="yellow")
-        return {"name": "", "id": tid, "tactics": []}
+        log.warning("    :warning: No info found for TTP: %s", tid)
+        return "", ()
         
     def scrape_mitre_name(self, tid: str) -> str | None:
+        # Anything that isn't shaped like a technique ID can't have a page, so don't spend
+        # up to ten requests finding that out (the None is memoized like any other result)
+        if not TTP_RE.fullmatch(tid):
+            return None
+
+        cached = self.name_cache.get(tid)
+        if cached is not None:
+            return cached
+
         # Try a few MITRE ATT&CK technique URL patterns to find a canonical name.
         # Some MITRE technique pages redirect using a client-side meta-refresh; follow those.
         MITRE_BASE = "https://attack.mitre.org"
-        candidates = []
-        if "." in tid:
-            base, sub = tid.split(".", 1)
-            sub = sub.zfill(3)
-            candidates.append(f"{MITRE_BASE}/techniques/{base}/{sub}/")
-            candidates.append(f"{MITRE_BASE}/techniques/{base}/")
+        base, _, sub = tid.partition(".")
+        if sub:
+            candidates = (f"{MITRE_BASE}/techniques/{base}/{int(sub):03d}/", f"{MITRE_BASE}/techniques/{base}/")
         else:
-            candidates.append(f"{MITRE_BASE}/techniques/{tid}/")
+            candidates = (f"{MITRE_BASE}/techniques/{tid}/",)
 
         max_follow = 5
         for start_url in candidates:
@@ -78,21 +368,26 @@ class MitreAttack:
             for _ in range(max_follow):
                 try:
                     resp_text = fetch(current_url)
-                except requests.HTTPError:
+                except httpx.HTTPStatusError:
                     break
 
-                s = BeautifulSoup(resp_text, "html.parser")
+                s = BeautifulSoup(resp_text, "lxml", parse_only=_MITRE_PAGE_STRAINER)
                 # If we have an <h1>, prefer that as the canonical title
                 h1 = s.find("h1")
                 if h1 and h1.get_text(strip=True):
                     text = h1.get_text(strip=True)
-                    return re.sub(r":(?!:)", ": ", text)
+                    name = _COLON_RE.sub(": ", text)
+                    with self.name_cache_lock:
+                        self.name_cache[tid] = name
+                        self.name_cache_dirty = True
+                    return name
 
-                # Look for meta refresh redirects and follow them if present
-                meta = s.find("meta")
+                # HTTP 3xx redirects were already followed by the client; only client-side
+                # meta-refresh redirects need following here
+                meta = s.find("meta", attrs={"http-equiv": _REFRESH_RE})
                 if meta and meta.get("content"):
                     content = str(meta.get("content"))
-                    murl = re.search(r"url=(.+)$", content, flags=re.I)
+                    murl = _META_URL_RE.search(content)
                     if murl:
                         target = murl.group(1).strip().strip('"').strip("'")
                         # build absolute URL for relative redirects